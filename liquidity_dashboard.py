@@ -1,10 +1,22 @@
 # liquidity_dashboard.py  (re-base to START of window)
 # ---------------------------------------------------------
-from io import StringIO
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
+import threading
+from pathlib import Path
+import time
+import diskcache
+import numpy as np
 import pandas as pd
+import plotly.graph_objects as go
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # ---------------------------------------------------------
 # CONFIG
@@ -19,46 +31,136 @@ FRED_SERIES = {
     "Reverse Repo (ON RRP)": "RRPONTSYD",
 }
 
+# sign of each series' contribution, in FRED_SERIES order: TGA and RRP drain liquidity
+SIGNS = np.array([-1.0, 1.0, 1.0, 1.0, -1.0])
+
+PRICE_SERIES = ("SP500", "CBBTCUSD", "CBETHUSD")
+
 # ---------------------------------------------------------
 # FRED LOADER
 # ---------------------------------------------------------
-@st.cache_data(ttl=3600, show_spinner="Fetching FRED data…")
+@st.cache_resource
+def get_session() -> requests.Session:
+    # one keep-alive pool per process (module code re-runs on every rerun)
+    session = requests.Session()
+    session.headers.update({"Accept-Encoding": "gzip, deflate", "User-Agent": "liquidity-dashboard"})
+    session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=8))
+    return session
+
+@st.cache_resource
+def get_disk_cache() -> diskcache.Cache:
+    # on-disk L2 cache under st.cache_data so FRED pulls survive process restarts
+    return diskcache.Cache(Path(__file__).parent / ".fred_cache")
+
+@st.cache_data(ttl=3600, show_spinner=False)
 def load_fred_series(series_id: str) -> pd.DataFrame:
+    disk_cache = get_disk_cache()
+    key = (series_id, dt.date.today().isoformat())
+    cached = disk_cache.get(key)
+    if cached is not None:
+        return cached
     url = f"https://fred.stlouisfed.org/graph/fredgraph.csv?id={series_id}"
-    resp = requests.get(url, timeout=15)
-    resp.raise_for_status()
-    df = pd.read_csv(StringIO(resp.text))
-    date_col = "DATE" if "DATE" in df.columns else df.columns[0]
-    value_col = series_id if series_id in df.columns else df.columns[1]
-    df = df.rename(columns={date_col: "date", value_col: "value"})
-    df["date"] = pd.to_datetime(df["date"])
-    df["value"] = pd.to_numeric(df["value"], errors="coerce")
-    return df.dropna(subset=["date", "value"])[["date", "value"]]
-
-@st.cache_data(ttl=3600)
+    with get_session().get(url, timeout=15, stream=True) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        # FRED CSVs are (date, value) with "." marking missing observations;
+        # float32 is ample for FRED precision and halves downstream memory traffic
+        df = pd.read_csv(resp.raw, usecols=[0, 1], parse_dates=[0],
+                         na_values=["."], dtype={1: "float32"}, engine="c")
+    df.columns = ["date", "value"]
+    df = df.dropna(subset=["date", "value"])
+    # load_all_fred slices by searchsorted, which needs ascending dates
+    if not df["date"].is_monotonic_increasing:
+        df = df.sort_values("date", ignore_index=True)
+    disk_cache.set(key, df, expire=3600)
+    return df
+
+def try_load_fred_series(series_id: str) -> pd.DataFrame | None:
+    # overlay series are optional: a failed fetch blanks its own tab, not the dashboard
+    try:
+        return load_fred_series(series_id)
+    except (requests.RequestException, ValueError):
+        return None
+
+def load_fred_batch(series_ids: list[str], fetch=load_fred_series) -> dict[str, pd.DataFrame]:
+    # fetch concurrently (network-bound): one round-trip of latency instead of len(series_ids)
+    # hand the script context to the workers so cached calls there don't warn about a missing one
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=len(series_ids),
+                            initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)) as ex:
+        return dict(zip(series_ids, ex.map(fetch, series_ids)))
+
+@st.cache_data(ttl=3600, show_spinner="Fetching FRED data…")
 def load_all_fred(start_date: dt.date) -> pd.DataFrame:
-    combined = None
+    fetched = load_fred_batch(list(FRED_SERIES.values()))
+    start = pd.Timestamp(start_date)
+    frames = []
     for label, sid in FRED_SERIES.items():
-        df = load_fred_series(sid)
-        df = df[df["date"] >= pd.to_datetime(start_date)].rename(columns={"value": label})
-        combined = df if combined is None else pd.merge(combined, df, on="date", how="outer")
-    return combined.sort_values("date").dropna()
+        df = fetched[sid]
+        df = df.iloc[df["date"].searchsorted(start):]
+        frames.append(df.set_index("date").rename(columns={"value": label}))
+    combined = pd.concat(frames, axis=1, join="outer", sort=True)
+    return combined.dropna().reset_index()
 
 # ---------------------------------------------------------
 # LIQUIDITY INDEX
 # ---------------------------------------------------------
+@st.cache_data(ttl=3600, show_spinner=False)
 def compute_liquidity_scores(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    for col in FRED_SERIES.keys():
-        mean, std = out[col].mean(), out[col].std() or 1e-9
-        out[f"{col}_z"] = (out[col] - mean) / std
-    out["TGA (WTREGEN)_z"] *= -1
-    out["Reverse Repo (ON RRP)_z"] *= -1
-    z_cols = [c for c in out.columns if c.endswith("_z")]
-    out["liquidity_z"] = out[z_cols].sum(axis=1)
-    out["liquidity_index"] = out["liquidity_z"].rank(pct=True) * 100
+    cols = list(FRED_SERIES)
+    X = df[cols].to_numpy(dtype=np.float64)
+    mu, sd = X.mean(axis=0), X.std(axis=0, ddof=1)
+    sd[sd == 0] = 1e-9
+    Z = (X - mu) / sd * SIGNS
+    z_df = pd.DataFrame(Z, columns=[f"{c}_z" for c in cols], index=df.index)
+    out = pd.concat([df, z_df], axis=1)
+    liq = Z.sum(axis=1)
+    out["liquidity_z"] = liq
+    # percentile rank, same scale as rank(pct=True) * 100 (ties are not expected)
+    out["liquidity_index"] = (liq.argsort().argsort() + 1) * (100.0 / max(len(liq), 1))
     return out
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
+    # Arrow's multi-threaded C++ writer; dates cast to date32 to keep YYYY-MM-DD output
+    tbl = pa.Table.from_pandas(df, preserve_index=False)
+    i = tbl.schema.get_field_index("date")
+    tbl = tbl.set_column(i, "date", tbl.column(i).cast(pa.date32()))
+    buf = pa.BufferOutputStream()
+    pacsv.write_csv(tbl, buf)
+    return buf.getvalue().to_pybytes()
+
+@st.cache_resource
+def refresh_state() -> dict:
+    # process-wide, so a Force Refresh in one session invalidates the others' stashed scores
+    return {"refreshed_at": 0.0}
+
+# ---------------------------------------------------------
+# CHARTS
+# ---------------------------------------------------------
+def crypto_overlay_fig(overlay: pd.DataFrame, name: str, color: str) -> go.Figure:
+    fig = go.Figure()
+    # left axis: liquidity
+    fig.add_trace(go.Scatter(
+        x=overlay["date"], y=overlay["liquidity_index"],
+        name="Liquidity Index", yaxis="y", line=dict(color="#00bfff")))
+    # right axis: crypto price
+    fig.add_trace(go.Scatter(
+        x=overlay["date"], y=overlay["price"],
+        name=f"{name} Price", yaxis="y2", line=dict(color=color)))
+    fig.update_layout(
+        xaxis_title="Date",
+        yaxis=dict(title="Liquidity Index", side="left"),
+        yaxis2=dict(title=f"{name} USD", side="right", overlaying="y", showgrid=False),
+        legend=dict(x=0, y=1.1, orientation="h"))
+    return fig
+
+def price_overlay(liquidity_index: pd.Series, prices: pd.DataFrame | None) -> pd.DataFrame:
+    if prices is None:
+        return pd.DataFrame(columns=["date", "liquidity_index", "price"])
+    price = prices.set_index("date")["value"].rename("price")
+    return pd.concat([liquidity_index, price], axis=1, join="inner").reset_index()
+
 # ---------------------------------------------------------
 # SIDEBAR
 # ---------------------------------------------------------
@@ -68,14 +170,26 @@ with st.sidebar:
     start_date = st.date_input("Start Date", value=dt.date(2015, 1, 1), min_value=dt.date(2002, 1, 1))
     if st.button("Force Refresh"):
         st.cache_data.clear()
+        get_disk_cache().clear()
+        refresh_state()["refreshed_at"] = time.time()
         st.rerun()
 
 # ---------------------------------------------------------
 # LOAD DATA
 # ---------------------------------------------------------
-raw = load_all_fred(start_date)
-df = compute_liquidity_scores(raw)
-latest, prev = df.iloc[-1], df.iloc[-2]
+# reuse this session's scores while start_date is unchanged, skipping the cache-key hashing;
+# expire on the same 3600 s TTL as the data caches, or after a Force Refresh anywhere
+now = time.time()
+cached = st.session_state.get("scores")
+if (cached is None or cached[0] != start_date or now - cached[1] >= 3600
+        or cached[1] < refresh_state()["refreshed_at"]):
+    cached = (start_date, now, compute_liquidity_scores(load_all_fred(start_date)))
+    st.session_state["scores"] = cached
+df = cached[2]
+with st.spinner("Fetching FRED data…"):
+    prices = load_fred_batch(list(PRICE_SERIES), fetch=try_load_fred_series)
+df_idx = df.set_index("date")
+prev, latest = df.tail(2).to_dict("records")
 
 # ---------------------------------------------------------
 # TABS
@@ -85,86 +199,57 @@ tabs = st.tabs(["Overview", "Liquidity Score", "Components", "S&P 500", "Bitcoin
 with tabs[0]:  # Overview
     st.title("Global USD Liquidity Dashboard")
     cols = st.columns(6)
-    for i, col in enumerate(FRED_SERIES.keys()):
+    vals = np.array([latest[c] for c in FRED_SERIES])
+    deltas = vals - np.array([prev[c] for c in FRED_SERIES])
+    val_strs = [f"{v:,.0f}" for v in vals]
+    delta_strs = [f"{d:+,.0f}" for d in deltas]
+    for i, col in enumerate(FRED_SERIES):
         with cols[i]:
-            st.metric(col, f"{latest[col]:,.0f}", f"{latest[col] - prev[col]:+,.0f}")
+            st.metric(col, val_strs[i], delta_strs[i])
     with cols[5]:
         st.metric("Liquidity Score (z)", f"{latest['liquidity_z']:.2f}", f"{latest['liquidity_z'] - prev['liquidity_z']:+.2f}")
-    st.line_chart(df.set_index("date")["liquidity_z"])
+    st.line_chart(df_idx["liquidity_z"])
 
 with tabs[1]:  # Liquidity Score
     st.metric("Liquidity Index (0–100)", f"{latest['liquidity_index']:.1f}")
-    st.line_chart(df.set_index("date")[["liquidity_z", "liquidity_index"]])
+    st.line_chart(df_idx[["liquidity_z", "liquidity_index"]])
 
 with tabs[2]:  # Components
-    for col in FRED_SERIES.keys():
+    for col in FRED_SERIES:
         st.subheader(col)
-        st.line_chart(df.set_index("date")[col])
+        st.line_chart(df_idx[col])
 
 with tabs[3]:  # S&P 500
     st.header("Liquidity vs S&P 500")
-    sp = load_fred_series("SP500").rename(columns={"value": "price"})
-    overlay = pd.merge(df[["date", "liquidity_index"]], sp, on="date", how="inner")
+    overlay = price_overlay(df_idx["liquidity_index"], prices["SP500"])
     if not overlay.empty:
         overlay["liq_rebase"] = overlay["liquidity_index"] / overlay["liquidity_index"].iloc[0]
         overlay["sp_rebase"] = overlay["price"] / overlay["price"].iloc[0]
         st.line_chart(overlay.set_index("date")[["liq_rebase", "sp_rebase"]]
                          .rename(columns={"liq_rebase": "Liquidity", "sp_rebase": "S&P 500"}))
+    else:
+        st.warning("No S&P 500 data in selected range")
 
 with tabs[4]:  # Bitcoin
-    import plotly.graph_objects as go
-
     st.header("Liquidity Index vs Bitcoin Price")
-    btc = load_fred_series("CBBTCUSD").rename(columns={"value": "price"})
-    overlay = pd.merge(df[["date", "liquidity_index"]], btc, on="date", how="inner")
+    overlay = price_overlay(df_idx["liquidity_index"], prices["CBBTCUSD"])
     if overlay.empty:
         st.warning("No Bitcoin data in selected range (starts 2014-09)")
     else:
-        fig = go.Figure()
-        # left axis: liquidity
-        fig.add_trace(go.Scatter(
-            x=overlay["date"], y=overlay["liquidity_index"],
-            name="Liquidity Index", yaxis="y", line=dict(color="#00bfff")))
-        # right axis: BTC price
-        fig.add_trace(go.Scatter(
-            x=overlay["date"], y=overlay["price"],
-            name="BTC Price", yaxis="y2", line=dict(color="#f7931a")))
-        fig.update_layout(
-            xaxis_title="Date",
-            yaxis=dict(title="Liquidity Index", side="left"),
-            yaxis2=dict(title="BTC USD", side="right", overlaying="y", showgrid=False),
-            legend=dict(x=0, y=1.1, orientation="h"))
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(crypto_overlay_fig(overlay, "BTC", "#f7931a"), use_container_width=True)
         st.metric("Latest BTC Price (FRED)", f"${overlay['price'].iloc[-1]:,.0f}")
 
 with tabs[5]:  # Ethereum
-    import plotly.graph_objects as go
-
     st.header("Liquidity Index vs Ethereum Price")
-    eth = load_fred_series("CBETHUSD").rename(columns={"value": "price"})
-    overlay = pd.merge(df[["date", "liquidity_index"]], eth, on="date", how="inner")
+    overlay = price_overlay(df_idx["liquidity_index"], prices["CBETHUSD"])
     if overlay.empty:
         st.warning("No Ethereum data — starts ~2017")
     else:
-        fig = go.Figure()
-        # left axis: liquidity
-        fig.add_trace(go.Scatter(
-            x=overlay["date"], y=overlay["liquidity_index"],
-            name="Liquidity Index", yaxis="y", line=dict(color="#00bfff")))
-        # right axis: ETH price
-        fig.add_trace(go.Scatter(
-            x=overlay["date"], y=overlay["price"],
-            name="ETH Price", yaxis="y2", line=dict(color="#627eea")))
-        fig.update_layout(
-            xaxis_title="Date",
-            yaxis=dict(title="Liquidity Index", side="left"),
-            yaxis2=dict(title="ETH USD", side="right", overlaying="y", showgrid=False),
-            legend=dict(x=0, y=1.1, orientation="h"))
-        st.plotly_chart(fig, use_container_width=True)
+        st.plotly_chart(crypto_overlay_fig(overlay, "ETH", "#627eea"), use_container_width=True)
         st.metric("Latest ETH Price (FRED)", f"${overlay['price'].iloc[-1]:,.0f}")
 
 with tabs[6]:  # Raw Data
     st.dataframe(df, use_container_width=True)
-    st.download_button("Download CSV", df.to_csv(index=False), "liquidity_data.csv", "text/csv")
+    st.download_button("Download CSV", df_to_csv_bytes(df), "liquidity_data.csv", "text/csv")
 
 st.success("Dashboard running crash-free with FRED crypto prices (re-based to start of window)")